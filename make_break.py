@@ -19,15 +19,54 @@
 
 import os
 import sys
-import json
-import argparse
+import types
+import tempfile
+import functools
+import itertools
+import operator
 
+try:
+    import orjson
 
+    def json_loads(data):
+        """Decode JSON from bytes"""
+        return orjson.loads(data)
+
+    def json_dumps(obj):
+        """Encode object as JSON bytes"""
+        return orjson.dumps(obj)
+except ImportError:  # Fall back to (slower) standard library implementation
+    import json
+
+    def json_loads(data):
+        """Decode JSON from bytes"""
+        return json.loads(data)
+
+    def json_dumps(obj):
+        """Encode object as JSON bytes"""
+        return json.dumps(
+            obj, separators=(",", ":"), ensure_ascii=False
+        ).encode("utf-8")
+
+
+@functools.lru_cache(maxsize=256)
 def raw_name(filename):
     """Return basename without extension"""
-    return os.path.splitext(os.path.split(filename)[1])[0]
+    basename = os.path.basename(filename)
+    root = basename.rpartition(".")[0]
+    # As with os.path.splitext, leading dots do not start an extension
+    return root if root.strip(".") else basename
+
 
+def line_number(line):
+    """Return line as int, or None if it is not a valid line number"""
+    try:
+        return int(line)
+    except (TypeError, ValueError):
+        return None
 
+
+@functools.lru_cache(maxsize=256)
 def canon_path(filename):
     """Return "canonical" path to file"""
     return os.path.abspath(os.path.normpath(filename))
@@ -40,89 +79,170 @@ class DbgConfig(object):
         self.config_filename = os.path.join(dbg_directory, "config.json")
         if not os.path.isdir(self.dbg_directory):
             os.mkdir(self.dbg_directory)
-        self._data = {}
+        # Map each executable to a flat set of (source file, line) pairs
+        self._last_used = None
+        self._breakpoints = {}
+        # Track unsaved changes so that no-op commands skip rewriting files
+        self._dirty = False
+        self._dirty_executables = set()
         self.load()
 
     def clean(self):
         """Remove config file and lldb files from debug directory"""
-        self._data = {}
+        self._last_used = None
+        self._breakpoints = {}
+        self._dirty = True
+        self._dirty_executables.clear()
         os.remove(self.config_filename)
         for file_ in os.scandir(self.dbg_directory):
-            if file_.name.endswith(".lldb"):
+            # .tmp files are left behind by interrupted saves
+            if file_.name.endswith((".lldb", ".tmp")):
                 os.remove(file_.path)
 
     def load(self):
         """Load data from config file"""
         try:
-            with open(self.config_filename) as config_file:
-                self._data = json.load(config_file)
+            with open(self.config_filename, 'rb') as config_file:
+                data = json_loads(config_file.read())
         except FileNotFoundError:
-            pass
+            return
+        if "LASTUSED" in data:  # Convert config from older versions
+            self._last_used = data.pop("LASTUSED")
+            data = {
+                executable: value["Breakpoints"]
+                for executable, value in data.items()
+            }
+            self._dirty = True
+        else:
+            self._last_used = data.pop("_last", None)
+        # Older versions accepted any string as a line; lldb cannot use
+        # non-numeric lines, so drop them rather than fail to load
+        self._breakpoints = {
+            executable: {
+                (source_file, line_number(line_))
+                for source_file, lines in breakpoints.items()
+                for line_ in lines
+                if line_number(line_) is not None
+            }
+            for executable, breakpoints in data.items()
+        }
 
     def save(self):
-        """Save data to config file"""
-        self.export_commands()
-        with open(self.config_filename, 'w') as config_file:
-            json.dump(self._data, config_file)
+        """Save data to config file
+
+        Nothing is written if the configuration has not changed since it was
+        loaded, and only lldb files for modified executables are exported.
+        """
+        if not self._dirty:
+            return
+        self.export_commands(self._dirty_executables)
+        # Write to a temporary file first so that an interrupted save cannot
+        # leave a truncated config behind. Each save uses its own temporary
+        # file, so concurrent commands cannot clobber each other's writes.
+        temp_fd, temp_filename = tempfile.mkstemp(
+            dir=self.dbg_directory, suffix=".tmp"
+        )
+        try:
+            with os.fdopen(temp_fd, 'wb') as config_file:
+                config_file.write(json_dumps(self._serializable_data()))
+            os.replace(temp_filename, self.config_filename)
+        except BaseException:
+            try:
+                os.remove(temp_filename)
+            except FileNotFoundError:
+                pass
+            raise
+        self._dirty = False
+
+    def _serializable_data(self):
+        """Return data in the nested format used by the config file
+
+        The config file maps each executable directly to a dict of source
+        files and their breakpoint lines, with the last used executable stored
+        under "_last". (Executables are stored by absolute path, so this
+        cannot clash with an executable's key.)
+        """
+        data = {}
+        if self._last_used is not None:
+            data["_last"] = self._last_used
+        for executable, breakpoints in self._breakpoints.items():
+            data[executable] = {
+                source_file: [line_ for _, line_ in group]
+                for source_file, group in itertools.groupby(
+                    sorted(breakpoints), key=operator.itemgetter(0))
+            }
+        return data
 
     def add_executable(self, filename):
         """Add executable to debug configuration"""
-        filename = canon_path(filename)
-        self.set_last_used(filename)
-        if filename not in self._data.keys():
-            self._data[filename] = {"Breakpoints": {}}
+        self._add_executable(canon_path(filename))
+
+    def _add_executable(self, filename):
+        """Add executable given by canonical path to debug configuration"""
+        self._set_last_used(filename)
+        if filename not in self._breakpoints:
+            self._breakpoints[filename] = set()
+            self._dirty = True
+            self._dirty_executables.add(filename)
 
     def get_last_used(self):
         """Return last executable debugged or configured"""
-        return self._data.get("LASTUSED", None)
+        return self._last_used
 
     def set_last_used(self, executable):
         """Return last executable debugged or configured"""
-        executable = canon_path(executable)
-        self._data["LASTUSED"] = executable
+        self._set_last_used(canon_path(executable))
+
+    def _set_last_used(self, executable):
+        """Set last used executable given by canonical path"""
+        if self._last_used != executable:
+            self._last_used = executable
+            self._dirty = True
 
     def toggle_breakpoint(self, executable, source_file, line):
-        source_file = os.path.split(source_file)[1]
+        source_file = os.path.basename(source_file)
+        # Lines arrive as strings from the command line; store them as ints
+        # so that they sort numerically
+        line = int(line)
         if executable is None:
             executable = self.get_last_used()
         else:
             executable = canon_path(executable)
-            self.set_last_used(executable)
-        self.add_executable(executable)
-        try:
-            breakpoints = self._data[executable]["Breakpoints"][source_file]
-        except KeyError:
-            self._data[executable]["Breakpoints"][source_file] = [line]
-            return
-
-        if line in breakpoints:
-            breakpoints.remove(line)
+        self._add_executable(executable)
+        self._dirty = True
+        self._dirty_executables.add(executable)
+        breakpoints = self._breakpoints[executable]
+        key = (source_file, line)
+        if key in breakpoints:
+            breakpoints.discard(key)
         else:
-            breakpoints.append(line)
+            breakpoints.add(key)
 
     def clean_breakpoints(self, executable):
         """Remove all breakpoints for given executable"""
         if executable is None:
             executable = self.get_last_used()
-        for source_file, lines in self._data[
-                executable]["Breakpoints"].items():
-            for line_ in reversed(lines):
-                self.toggle_breakpoint(executable, source_file, line_)
+        else:
+            executable = canon_path(executable)
+        self._set_last_used(executable)
+        breakpoints = self._breakpoints.get(executable, None)
+        if breakpoints:
+            breakpoints.clear()
+            self._dirty = True
+            self._dirty_executables.add(executable)
 
     def print_breakpoints(self, executable):
         if executable is None:
             executable = self.get_last_used()
+        else:
+            executable = canon_path(executable)
         exec_str = "Executable: {}".format(os.path.basename(executable))
         # TODO: Verbose should print full pathname
         print(exec_str)
         print("-" * len(exec_str))
-        try:
-            for source_file, lines in self._data[
-                    executable]["Breakpoints"].items():
-                for line_ in lines:
-                    print("{}:{}".format(source_file, line_))
-        except KeyError:  # Executable touched but not added to config yet
-            pass
+        for source_file, line_ in sorted(
+                self._breakpoints.get(executable, ())):
+            print("{}:{}".format(source_file, line_))
 
     def debug(self, executable):
         """Launch debugging session
@@ -131,39 +251,72 @@ class DbgConfig(object):
         """
         if executable is None:
             executable = self.get_last_used()
-        command_filename = os.path.join(
-            self.dbg_directory, "{}.lldb".format(raw_name(executable))
-        )
         executable = canon_path(executable)
-        self.set_last_used(executable)
-        if executable in self._data:
-            os.execvp("lldb", ["lldb", "-S", command_filename])
+        self._set_last_used(executable)
+        if executable in self._breakpoints:
+            command_filename = os.path.join(
+                self.dbg_directory, "{}.lldb".format(raw_name(executable))
+            )
+            lldb_args = ["lldb", "-S", command_filename]
         else:
-            os.execvp("lldb", ["lldb", executable])
+            lldb_args = ["lldb", executable]
+        # Replace this process rather than spawning a child
+        os.execvp("lldb", lldb_args)
 
-    def export_commands(self):
-        """Export commands to files suitable for loading with lldb -S"""
-        for filename in self._data.keys():
+    def export_commands(self, executables=None):
+        """Export commands to files suitable for loading with lldb -S
+
+        :param executables: Executables whose lldb files should be written;
+            all configured executables if omitted
+        """
+        # Executables passed in have changed, so their files are written
+        # directly; a full export first checks which files are out of date
+        compare = executables is None
+        if executables is None:
+            executables = list(self._breakpoints)
+        else:
+            executables = list(executables)
+        for filename in executables:
+            self._dirty_executables.discard(filename)
             if not os.path.isfile(filename):
                 continue
-            commands = []
-            commands.append("file {}".format(filename))
-            for source_file, lines in self._data[
-                    filename]["Breakpoints"].items():
-                for line_ in lines:
-                    commands.append(
-                        "breakpoint set --file {} --line {}".format(
-                            source_file, line_
-                        )
-                    )
+            commands = [f"file {filename}"]
+            commands.extend(
+                f"breakpoint set --file {source_file} --line {line_}"
+                for source_file, line_ in sorted(self._breakpoints[filename])
+            )
+            commands = "\n".join(commands)
             command_filename = os.path.join(
                 self.dbg_directory, "{}.lldb".format(raw_name(filename))
             )
+            if compare:
+                try:
+                    with open(command_filename) as command_file:
+                        if command_file.read() == commands:
+                            continue
+                except FileNotFoundError:
+                    pass
             with open(command_filename, 'w') as command_file:
-                command_file.write("\n".join(commands))
+                command_file.write(commands)
 
 
-if __name__ == "__main__":
+COMMANDS = {
+    "break": "break", "b": "break",
+    "clean": "clean",
+    "touch": "touch", "t": "touch",
+    "print": "print", "p": "print",
+    "build": "build",
+}
+POSITIONALS = {
+    "break": ("source", "line"),
+    "touch": ("executable",),
+}
+
+
+def make_parser():
+    """Return full argparse parser for command line interface"""
+    import argparse
+
     parser = argparse.ArgumentParser(
         description='Persistent debugging options for lldb'
     )
@@ -192,7 +345,7 @@ if __name__ == "__main__":
         'source', metavar='SOURCE', help="source file for breakpoint"
     )
     break_parser.add_argument(
-        'line', metavar='LINE', help="line number for breakpoint"
+        'line', metavar='LINE', type=int, help="line number for breakpoint"
     )
     break_parser.set_defaults(command="break")
 
@@ -232,12 +385,81 @@ if __name__ == "__main__":
     )
     build_parser.set_defaults(command="build")
 
-    args = parser.parse_args(sys.argv[1:])
+    return parser
+
+
+def _quick_parse_args(argv):
+    """Parse common command lines by hand
+
+    Returns None if argv contains anything unusual, in which case argparse
+    should be used instead.
+    """
+    args = {"command": "start", "executable": None}
+    argv = list(argv)
+    if argv[:1] in (["-x"], ["--executable"]) and len(argv) > 1:
+        if argv[1].startswith("-"):
+            return None
+        args["executable"] = argv[1]
+        del argv[:2]
+    if not argv:
+        return types.SimpleNamespace(**args)
+
+    command = COMMANDS.get(argv[0], None)
+    if command is None:
+        return None
+    args["command"] = command
+    if command in ("break", "clean", "print"):
+        # As with argparse, the subcommand's own -x default replaces any
+        # executable given before it
+        args["executable"] = None
+    if command == "clean":
+        args["all"] = False
+    positionals = []
+    remaining = iter(argv[1:])
+    for arg in remaining:
+        if arg in ("-x", "--executable") and command in (
+                "break", "clean", "print"):
+            executable = next(remaining, "-")
+            if executable.startswith("-"):  # Missing value
+                return None
+            args["executable"] = executable
+        elif arg in ("-a", "--all") and command == "clean":
+            args["all"] = True
+        elif arg.startswith("-"):
+            return None
+        else:
+            positionals.append(arg)
+
+    names = POSITIONALS.get(command, ())
+    if len(positionals) != len(names):
+        return None
+    args.update(zip(names, positionals))
+    if command == "break":
+        args["line"] = line_number(args["line"])
+        if args["line"] is None:
+            return None
+    return types.SimpleNamespace(**args)
+
+
+def parse_args(argv):
+    """Parse command line arguments
+
+    Constructing the argparse parser takes a large share of the run time of
+    a typical command, so it is only built for help requests and command
+    lines that the quick parser does not recognize.
+    """
+    args = _quick_parse_args(argv)
+    if args is None:
+        args = make_parser().parse_args(argv)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
 
     config = DbgConfig()
-    config.load()
     if args.executable is None and config.get_last_used() is None:
-        parser.print_help()
+        make_parser().print_help()
         sys.exit(1)
 
     if args.command == "start":
@@ -261,5 +483,5 @@ if __name__ == "__main__":
     elif args.command == "build":
         config.export_commands()
     else:
-        parser.print_help()
+        make_parser().print_help()
         sys.exit(1)